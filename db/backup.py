@@ -0,0 +1,456 @@
+import os
+import hmac
+import hashlib
+import json
+import sys
+from datetime import datetime, timezone
+from Crypto.Cipher import AES
+from Crypto.Hash import SHA256
+from Crypto.Protocol.KDF import HKDF, PBKDF2
+from Crypto.Random import get_random_bytes
+
+try:
+    from .dbManager import EncryptedFileBackend, UserDatabase, _connect_image
+except ImportError:
+    # Run as a script from db/, like dbManager.py
+    from dbManager import EncryptedFileBackend, UserDatabase, _connect_image
+
+
+
+class BackupStore:
+    """Encrypted, content-addressed snapshots of a file-backed UserDatabase
+
+    Layout of backup_dir:
+        salt                  salt the backup keys are derived from
+        kdf.json              PBKDF2 parameters used with that salt
+        lock                  held while a snapshot or prune is running
+        chunks/ab/<id>        AES-GCM encrypted chunk (nonce + tag + ciphertext)
+        snapshots/<id>.json   manifest listing the chunk ids of one snapshot
+
+    Chunk ids are an HMAC-SHA256 of the plaintext chunk, so identical pages
+    are stored once across all snapshots without revealing their content.
+
+    Backups only ever read user.db.enc; they never open a session on the live
+    database, so they are safe to run while the server is handling requests.
+    """
+
+    # Multiple of the SQLite page size so unchanged pages map to unchanged chunks
+    CHUNK_SIZE = 64 * 1024
+
+    # PBKDF2 parameters for new backup directories; existing ones keep the
+    # parameters recorded in their kdf.json
+    KDF_ITERATIONS = 600000
+    KDF_HASH = 'SHA256'
+    KDF_HASHES = {'SHA256': SHA256}
+
+    def __init__(self, db, backup_dir='backups'):
+        if not isinstance(db.backend, EncryptedFileBackend):
+            raise ValueError("Backups require a database using EncryptedFileBackend")
+        self.backend = db.backend
+        self.backup_dir = backup_dir
+        self.chunk_dir = os.path.join(backup_dir, 'chunks')
+        self.snapshot_dir = os.path.join(backup_dir, 'snapshots')
+        self.salt_file = os.path.join(backup_dir, 'salt')
+        self.kdf_file = os.path.join(backup_dir, 'kdf.json')
+        self.lock_file = os.path.join(backup_dir, 'lock')
+        self._lock_held = False
+        self._keys = None
+
+    def _ensure_dirs(self):
+        """Create the backup directory layout"""
+        os.makedirs(self.chunk_dir, exist_ok=True)
+        os.makedirs(self.snapshot_dir, exist_ok=True)
+
+    def _acquire_lock(self):
+        """
+        Take the backup directory lock shared by snapshot and prune
+
+        prune deletes every chunk no manifest references, which would include
+        chunks a concurrent snapshot has stored (or found already stored) but
+        not yet written its manifest for, so the two must never overlap.
+        """
+        self._ensure_dirs()
+        try:
+            fd = os.open(self.lock_file, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            raise ValueError(f"'{self.lock_file}' exists: another snapshot or prune is running "
+                             f"(delete the file if that process has died)")
+        with os.fdopen(fd, 'w') as f:
+            f.write(str(os.getpid()))
+        self._lock_held = True
+
+    def _release_lock(self):
+        """Release the backup directory lock if this store holds it"""
+        if self._lock_held:
+            os.remove(self.lock_file)
+            self._lock_held = False
+
+    def _get_keys(self):
+        """
+        Derive the chunk encryption and chunk id keys
+
+        Both come from the database password and the backup salt (not the
+        live database salt), so restoring never depends on or changes
+        user.db.salt. Separate HKDF subkeys keep AES-GCM and HMAC apart.
+        """
+        if self._keys is not None:
+            return self._keys
+
+        if os.path.exists(self.salt_file):
+            with open(self.salt_file, 'rb') as f:
+                salt = f.read()
+            with open(self.kdf_file, 'r') as f:
+                kdf = json.load(f)
+        else:
+            salt = get_random_bytes(32)
+            kdf = {'iterations': self.KDF_ITERATIONS, 'hash': self.KDF_HASH}
+            self._ensure_dirs()
+            with open(self.kdf_file, 'w') as f:
+                json.dump(kdf, f)
+            with open(self.salt_file, 'wb') as f:
+                f.write(salt)
+
+        if kdf['hash'] not in self.KDF_HASHES:
+            raise ValueError(f"Unsupported backup key hash '{kdf['hash']}'")
+
+        master = PBKDF2(self.backend.password, salt, dkLen=32, count=kdf['iterations'],
+                        hmac_hash_module=self.KDF_HASHES[kdf['hash']])
+        self._keys = (
+            HKDF(master, 32, b'', SHA256, context=b'chunk-enc'),
+            HKDF(master, 32, b'', SHA256, context=b'chunk-id')
+        )
+        return self._keys
+
+    def _chunk_id(self, id_key, data):
+        """Keyed content address of a plaintext chunk"""
+        return hmac.new(id_key, data, hashlib.sha256).hexdigest()
+
+    def _chunk_path(self, chunk_id):
+        return os.path.join(self.chunk_dir, chunk_id[:2], chunk_id)
+
+    def _write_chunk(self, enc_key, chunk_id, data):
+        """Encrypt and store a chunk unless it is already present"""
+        path = self._chunk_path(chunk_id)
+        if os.path.exists(path):
+            return False
+
+        cipher = AES.new(enc_key, AES.MODE_GCM)
+        ciphertext, tag = cipher.encrypt_and_digest(data)
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(cipher.nonce + tag + ciphertext)
+        os.replace(tmp_path, path)
+        return True
+
+    def _read_chunk(self, enc_key, id_key, chunk_id):
+        """Decrypt a chunk and check it against its content address"""
+        with open(self._chunk_path(chunk_id), 'rb') as f:
+            encrypted_bytes = f.read()
+
+        nonce = encrypted_bytes[:16]
+        tag = encrypted_bytes[16:32]
+        ciphertext = encrypted_bytes[32:]
+
+        cipher = AES.new(enc_key, AES.MODE_GCM, nonce=nonce)
+        data = cipher.decrypt_and_verify(ciphertext, tag)
+
+        if not hmac.compare_digest(self._chunk_id(id_key, data), chunk_id):
+            raise ValueError(f"Chunk {chunk_id} does not match its content address")
+        return data
+
+    def snapshot(self):
+        """
+        Take a consistent snapshot of the database and store new chunks
+
+        The snapshot is the last committed user.db.enc, decrypted in memory.
+        Live files are only read, never rewritten.
+
+        Returns:
+            Manifest dictionary of the snapshot, or None on failure
+        """
+        try:
+            self._acquire_lock()
+
+            image = self.backend.read_image()
+            if image is None:
+                raise ValueError(f"'{self.backend.encrypted_name}' does not exist")
+
+            enc_key, id_key = self._get_keys()
+
+            chunks = []
+            new_chunks = 0
+            for offset in range(0, len(image), self.CHUNK_SIZE):
+                data = image[offset:offset + self.CHUNK_SIZE]
+                chunk_id = self._chunk_id(id_key, data)
+                if self._write_chunk(enc_key, chunk_id, data):
+                    new_chunks += 1
+                chunks.append(chunk_id)
+
+            created_at = datetime.now(timezone.utc)
+            manifest = {
+                'id': created_at.strftime('%Y%m%dT%H%M%S%fZ'),
+                'created_at': created_at.isoformat(),
+                'size': len(image),
+                'digest': self._chunk_id(id_key, image),
+                'chunks': chunks
+            }
+
+            # Manifest is written last so a snapshot only exists once all chunks do
+            manifest_path = os.path.join(self.snapshot_dir, manifest['id'] + '.json')
+            with open(manifest_path + '.tmp', 'w') as f:
+                json.dump(manifest, f)
+            os.replace(manifest_path + '.tmp', manifest_path)
+
+            print(f"Snapshot '{manifest['id']}' stored "
+                  f"({new_chunks} new of {len(chunks)} chunks)")
+            return manifest
+
+        except Exception as e:
+            print(f"Error taking snapshot: {e}")
+            return None
+
+        finally:
+            self._release_lock()
+
+    def list_snapshots(self):
+        """Return snapshot manifests, oldest first"""
+        if not os.path.isdir(self.snapshot_dir):
+            return []
+
+        manifests = []
+        for filename in sorted(os.listdir(self.snapshot_dir)):
+            if filename.endswith('.json'):
+                with open(os.path.join(self.snapshot_dir, filename), 'r') as f:
+                    manifests.append(json.load(f))
+        return manifests
+
+    def _load_manifest(self, snapshot_id):
+        path = os.path.join(self.snapshot_dir, snapshot_id + '.json')
+        if not os.path.exists(path):
+            raise ValueError(f"Snapshot '{snapshot_id}' not found")
+        with open(path, 'r') as f:
+            return json.load(f)
+
+    def _rebuild_image(self, snapshot_id):
+        """Reassemble and verify the plaintext database image of a snapshot"""
+        manifest = self._load_manifest(snapshot_id)
+        enc_key, id_key = self._get_keys()
+
+        image = b''.join(self._read_chunk(enc_key, id_key, chunk_id)
+                         for chunk_id in manifest['chunks'])
+
+        if len(image) != manifest['size'] or \
+                not hmac.compare_digest(self._chunk_id(id_key, image), manifest['digest']):
+            raise ValueError(f"Snapshot '{snapshot_id}' failed verification")
+        return image
+
+    def _check_integrity(self, image):
+        """Run PRAGMA integrity_check on an in-memory copy of an image"""
+        conn = _connect_image(image)
+        try:
+            return conn.execute('PRAGMA integrity_check').fetchone()[0]
+        finally:
+            conn.close()
+
+    def verify(self, snapshot_id):
+        """
+        Check that a snapshot decrypts and matches its recorded digest
+
+        Returns:
+            True if the snapshot is intact, False otherwise
+        """
+        try:
+            self._rebuild_image(snapshot_id)
+            print(f"Snapshot '{snapshot_id}' verified")
+            return True
+        except Exception as e:
+            print(f"Error verifying snapshot: {e}")
+            return False
+
+    def _session_open(self):
+        """Report whether a database session (plaintext user.db) is open"""
+        if os.path.exists(self.backend.db_name):
+            print(f"'{self.backend.db_name}' exists, so a database session is open; "
+                  f"stop the server before restoring")
+            return True
+        return False
+
+    def restore(self, snapshot_id, force=False):
+        """
+        Restore a verified snapshot as the encrypted database
+
+        Nothing live is touched until the snapshot has been decrypted,
+        checked against its digest and passed PRAGMA integrity_check on an
+        in-memory copy. The image is then re-encrypted under the live
+        database key and swapped in atomically, so a failed restore leaves
+        the current database as is.
+
+        The server must be stopped first. While a session is open the
+        plaintext user.db exists and would be encrypted back over the
+        restored file when the session closes, so restore refuses to run.
+
+        Args:
+            snapshot_id: Id of the snapshot to restore
+            force: Overwrite an existing encrypted database
+
+        Returns:
+            True if successful, False otherwise
+        """
+        try:
+            if os.path.exists(self.backend.encrypted_name) and not force:
+                print(f"'{self.backend.encrypted_name}' already exists, use force to overwrite")
+                return False
+
+            if self._session_open():
+                return False
+
+            image = self._rebuild_image(snapshot_id)
+
+            result = self._check_integrity(image)
+            if result != 'ok':
+                print(f"Snapshot '{snapshot_id}' failed integrity check: {result}")
+                return False
+
+            # Check again: verification takes a while and a session may have started
+            if self._session_open():
+                return False
+
+            self.backend.write_image(image)
+            print(f"Snapshot '{snapshot_id}' restored to '{self.backend.encrypted_name}'")
+            return True
+
+        except Exception as e:
+            print(f"Error restoring snapshot: {e}")
+            return False
+
+    def prune(self, keep):
+        """
+        Delete all but the newest `keep` snapshots and their unused chunks
+
+        Args:
+            keep: Number of most recent snapshots to keep
+
+        Returns:
+            Tuple of (snapshots removed, chunks removed), or None on failure
+        """
+        try:
+            if keep < 1:
+                raise ValueError("keep must be at least 1")
+
+            self._acquire_lock()
+            manifests = self.list_snapshots()
+            expired = manifests[:-keep]
+            referenced = {chunk_id for m in manifests[-keep:] for chunk_id in m['chunks']}
+
+            # Drop manifests first so no remaining snapshot points at a deleted chunk
+            for manifest in expired:
+                os.remove(os.path.join(self.snapshot_dir, manifest['id'] + '.json'))
+
+            removed_chunks = 0
+            if os.path.isdir(self.chunk_dir):
+                for prefix in os.listdir(self.chunk_dir):
+                    prefix_dir = os.path.join(self.chunk_dir, prefix)
+                    for chunk_id in os.listdir(prefix_dir):
+                        if chunk_id not in referenced:
+                            os.remove(os.path.join(prefix_dir, chunk_id))
+                            removed_chunks += 1
+
+            print(f"Pruned {len(expired)} snapshot(s) and {removed_chunks} chunk(s)")
+            return len(expired), removed_chunks
+
+        except Exception as e:
+            print(f"Error pruning snapshots: {e}")
+            return None
+
+        finally:
+            self._release_lock()
+
+
+def main():
+    """
+    Main function to handle CLI arguments
+
+    Usage:
+        python backup.py snapshot
+        python backup.py list
+        python backup.py verify <snapshot_id>
+        python backup.py restore <snapshot_id> [--force]
+        python backup.py prune <keep>
+    """
+
+    usage = (
+        "Usage: python backup.py <command> [snapshot_id | keep] [--force]\n"
+        "\nCommands:\n"
+        "  snapshot - Back up the live database\n"
+        "  list     - List stored snapshots\n"
+        "  verify   - Verify a snapshot\n"
+        "  restore  - Restore a snapshot (--force overwrites the current database)\n"
+        "  prune    - Keep only the newest <keep> snapshots"
+    )
+
+    args = sys.argv[1:]
+    if not args or args[0] not in ['snapshot', 'list', 'verify', 'restore', 'prune']:
+        print(usage)
+        sys.exit(1)
+
+    command = args[0]
+    if command in ['verify', 'restore'] and len(args) < 2:
+        print(f"Error: '{command}' requires a snapshot_id")
+        sys.exit(1)
+
+    if command == 'prune' and (len(args) < 2 or not args[1].isdigit()):
+        print("Error: 'prune' requires the number of snapshots to keep")
+        sys.exit(1)
+
+    # Get password and backup location from environment variables
+    DB_PASSWORD = os.getenv('DB_PASSWORD', 'my_super_secret_password')
+    BACKUP_DIR = os.getenv('BACKUP_DIR', 'backups')
+
+    db = UserDatabase(db_name='user.db', password=DB_PASSWORD)
+    store = BackupStore(db, backup_dir=BACKUP_DIR)
+
+    if command == 'snapshot':
+        manifest = store.snapshot()
+        result = {
+            "success": manifest is not None,
+            "action": "snapshot",
+            "snapshot_id": manifest['id'] if manifest else None
+        }
+        print(json.dumps(result))
+        sys.exit(0 if manifest else 1)
+
+    elif command == 'list':
+        snapshots = [
+            {"id": m['id'], "created_at": m['created_at'], "size": m['size'],
+             "chunks": len(m['chunks'])}
+            for m in store.list_snapshots()
+        ]
+        print(json.dumps(snapshots, indent=2))
+        sys.exit(0)
+
+    elif command == 'verify':
+        success = store.verify(args[1])
+        print(json.dumps({"success": success, "action": "verify", "snapshot_id": args[1]}))
+        sys.exit(0 if success else 1)
+
+    elif command == 'restore':
+        success = store.restore(args[1], force='--force' in args[2:])
+        print(json.dumps({"success": success, "action": "restore", "snapshot_id": args[1]}))
+        sys.exit(0 if success else 1)
+
+    elif command == 'prune':
+        pruned = store.prune(int(args[1]))
+        result = {
+            "success": pruned is not None,
+            "action": "prune",
+            "snapshots_removed": pruned[0] if pruned else 0,
+            "chunks_removed": pruned[1] if pruned else 0
+        }
+        print(json.dumps(result))
+        sys.exit(0 if pruned is not None else 1)
+
+
+if __name__ == "__main__":
+    main()
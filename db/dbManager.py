@@ -1,53 +1,85 @@
 import sqlite3
 import os
+import threading
 from Crypto.Cipher import AES
 from Crypto.Protocol.KDF import PBKDF2
 from Crypto.Random import get_random_bytes
 import json
 import base64
 import sys
+import tempfile
 
 
 
-class UserDatabase:
-    """Encrypted SQLite database for storing single user data"""
+def _connect_image(image):
+    """Open a private in-memory connection holding a copy of a database image"""
+    conn = sqlite3.connect(':memory:', check_same_thread=False)
+    if hasattr(conn, 'deserialize'):
+        conn.deserialize(image)
+        return conn
     
-    def __init__(self, db_name='user.db', password='your_password_here'):
-        self.db_name = db_name
-        self.encrypted_name = db_name + '.enc'
+    # Python < 3.11 has no deserialize; load through a private temp file
+    fd, path = tempfile.mkstemp(suffix='.db')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(image)
+        src = sqlite3.connect(path)
+        try:
+            src.backup(conn)
+        finally:
+            src.close()
+    finally:
+        os.remove(path)
+    return conn
+
+
+class StorageBackend:
+    """Base class for where the users database lives and how fields are encrypted
+    
+    Subclasses provide the salt and the connection lifecycle; the key
+    derivation and field-level AES-GCM crypto are shared so every backend
+    stores identical ciphertext formats.
+    """
+    
+    def __init__(self, password):
         self.password = password
-        self.salt_file = db_name + '.salt'
-        self.conn = None
+        self._key = None
     
-    def __enter__(self):
-        """Decrypt and open database"""
-        self._decrypt_database()
-        self.conn = sqlite3.connect(self.db_name)
-        return self.conn
+    def _load_salt(self):
+        """Return the salt used to derive the encryption key"""
+        raise NotImplementedError
     
-    def __exit__(self, exc_type, exc_val, exc_tb):
-        """Close and encrypt database"""
-        if self.conn:
-            self.conn.close()
-        self._encrypt_database()
+    def open(self):
+        """Start a session and return an open sqlite3 connection"""
+        raise NotImplementedError
+    
+    def close(self, conn):
+        """End the session started by open()"""
+        raise NotImplementedError
+    
+    def open_snapshot(self):
+        """
+        Return a private copy of the database as of now
+        
+        The caller owns the returned connection and must close it. It shares
+        no state with open()/close() sessions, so it can be read for as long
+        as needed; writes made after it was taken are not visible in it.
+        """
+        raise NotImplementedError
     
-    def _get_key(self):
+    def get_key(self):
         """Generate or retrieve encryption key from password"""
-        if os.path.exists(self.salt_file):
-            with open(self.salt_file, 'rb') as f:
-                salt = f.read()
-        else:
-            salt = get_random_bytes(32)
-            with open(self.salt_file, 'wb') as f:
-                f.write(salt)
-        return PBKDF2(self.password, salt, dkLen=32)
+        # PBKDF2 is deliberately slow; derive once per backend, not per field
+        if self._key is None:
+            self._key = PBKDF2(self.password, self._load_salt(), dkLen=32)
+        return self._key
     
-    def _encrypt_field(self, data):
+    def encrypt_field(self, data):
         """Encrypt a single field using AES-GCM"""
         if data is None:
             return None
         
-        key = self._get_key()
+        key = self.get_key()
         plaintext = str(data).encode('utf-8')
         
         cipher = AES.new(key, AES.MODE_GCM)
@@ -57,13 +89,13 @@ class UserDatabase:
         encrypted_data = cipher.nonce + tag + ciphertext
         return base64.b64encode(encrypted_data).decode('utf-8')
     
-    def _decrypt_field(self, encrypted_data):
+    def decrypt_field(self, encrypted_data):
         """Decrypt a single field"""
         if encrypted_data is None:
             return None
         
         try:
-            key = self._get_key()
+            key = self.get_key()
             encrypted_bytes = base64.b64decode(encrypted_data)
             
             # Extract components
@@ -78,16 +110,72 @@ class UserDatabase:
         except Exception as e:
             print(f"Decryption error: {e}")
             return None
+
+
+class EncryptedFileBackend(StorageBackend):
+    """SQLite file that is decrypted for each session and re-encrypted after"""
     
-    def _encrypt_database(self):
-        """Encrypt the entire database file"""
-        if not os.path.exists(self.db_name):
-            return
+    def __init__(self, db_name='user.db', password='your_password_here'):
+        super().__init__(password)
+        self.db_name = db_name
+        self.encrypted_name = db_name + '.enc'
+        self.salt_file = db_name + '.salt'
+    
+    def _load_salt(self):
+        """Read the salt file, creating it on first use"""
+        if os.path.exists(self.salt_file):
+            with open(self.salt_file, 'rb') as f:
+                return f.read()
         
-        key = self._get_key()
+        salt = get_random_bytes(32)
+        with open(self.salt_file, 'wb') as f:
+            f.write(salt)
+        return salt
+    
+    def open(self):
+        """Decrypt and open database"""
+        self._decrypt_database()
+        return sqlite3.connect(self.db_name)
+    
+    def close(self, conn):
+        """Close and encrypt database"""
+        if conn:
+            conn.close()
+        self._encrypt_database()
+    
+    def open_snapshot(self):
+        """Decrypt the encrypted file into a private in-memory connection"""
+        image = self.read_image()
+        if image is None:
+            return sqlite3.connect(':memory:', check_same_thread=False)
+        return _connect_image(image)
+    
+    def read_image(self):
+        """
+        Decrypt the encrypted database file in memory
         
-        with open(self.db_name, 'rb') as f:
-            plaintext = f.read()
+        Returns:
+            Plaintext database bytes, or None if there is no database yet
+        """
+        if not os.path.exists(self.encrypted_name):
+            return None
+        
+        key = self.get_key()
+        
+        with open(self.encrypted_name, 'r') as f:
+            encrypted_data = json.load(f)
+        
+        cipher = AES.new(key, AES.MODE_GCM, 
+                        nonce=bytes.fromhex(encrypted_data['nonce']))
+        
+        return cipher.decrypt_and_verify(
+            bytes.fromhex(encrypted_data['ciphertext']),
+            bytes.fromhex(encrypted_data['tag'])
+        )
+    
+    def write_image(self, plaintext):
+        """Encrypt database bytes and atomically replace the encrypted file"""
+        key = self.get_key()
         
         cipher = AES.new(key, AES.MODE_GCM)
         ciphertext, tag = cipher.encrypt_and_digest(plaintext)
@@ -98,8 +186,21 @@ class UserDatabase:
             'ciphertext': ciphertext.hex()
         }
         
-        with open(self.encrypted_name, 'w') as f:
+        # Readers of the encrypted file never see a partially written one
+        tmp_name = self.encrypted_name + '.tmp'
+        with open(tmp_name, 'w') as f:
             json.dump(encrypted_data, f)
+        os.replace(tmp_name, self.encrypted_name)
+    
+    def _encrypt_database(self):
+        """Encrypt the entire database file"""
+        if not os.path.exists(self.db_name):
+            return
+        
+        with open(self.db_name, 'rb') as f:
+            plaintext = f.read()
+        
+        self.write_image(plaintext)
         
         # Try to remove the plaintext file, with retry logic
         try:
@@ -115,22 +216,10 @@ class UserDatabase:
     
     def _decrypt_database(self):
         """Decrypt the database file"""
-        if not os.path.exists(self.encrypted_name):
+        plaintext = self.read_image()
+        if plaintext is None:
             return
         
-        key = self._get_key()
-        
-        with open(self.encrypted_name, 'r') as f:
-            encrypted_data = json.load(f)
-        
-        cipher = AES.new(key, AES.MODE_GCM, 
-                        nonce=bytes.fromhex(encrypted_data['nonce']))
-        
-        plaintext = cipher.decrypt_and_verify(
-            bytes.fromhex(encrypted_data['ciphertext']),
-            bytes.fromhex(encrypted_data['tag'])
-        )
-        
         # Remove existing plaintext file if it exists
         if os.path.exists(self.db_name):
             try:
@@ -140,6 +229,101 @@ class UserDatabase:
         
         with open(self.db_name, 'wb') as f:
             f.write(plaintext)
+
+
+class MemoryBackend(StorageBackend):
+    """In-memory SQLite database for tests and ephemeral runs
+    
+    Nothing touches the filesystem: the connection stays open for the life
+    of the backend and the salt is generated in memory. Fields are still
+    encrypted exactly as in EncryptedFileBackend.
+    """
+    
+    def __init__(self, password='your_password_here'):
+        super().__init__(password)
+        self._salt = get_random_bytes(32)
+        self._conn = sqlite3.connect(':memory:', check_same_thread=False)
+        # One shared connection, so sessions from different threads take turns.
+        # Sessions never nest, and streams use open_snapshot() rather than
+        # holding a session, so a plain lock is never held across requests.
+        self._lock = threading.Lock()
+    
+    def _load_salt(self):
+        return self._salt
+    
+    def open(self):
+        self._lock.acquire()
+        return self._conn
+    
+    def close(self, conn):
+        # Discard anything the session did not commit, as closing the file
+        # engine's connection does, but keep the connection (and database) open
+        try:
+            conn.rollback()
+        finally:
+            self._lock.release()
+    
+    def open_snapshot(self):
+        """Copy the shared connection into a private in-memory connection"""
+        snapshot = sqlite3.connect(':memory:', check_same_thread=False)
+        with self._lock:
+            self._conn.backup(snapshot)
+        return snapshot
+
+
+def create_backend(kind='file', db_name='user.db', password='your_password_here'):
+    """
+    Build a storage backend by name
+    
+    Args:
+        kind: 'file' for the encrypted database file, 'memory' for in-memory
+        db_name: Database file name (only used by the file backend)
+        password: Password the encryption key is derived from
+        
+    Returns:
+        StorageBackend instance
+    """
+    if kind == 'file':
+        return EncryptedFileBackend(db_name=db_name, password=password)
+    if kind == 'memory':
+        return MemoryBackend(password=password)
+    raise ValueError(f"Unknown storage backend '{kind}'. Must be 'file' or 'memory'")
+
+
+class UserDatabase:
+    """Encrypted SQLite database for storing single user data"""
+    
+    # Columns of the users table, in table order (excluding id)
+    USER_FIELDS = (
+        'name', 'password', 'age', 'location', 'totalAmountInAccount',
+        'employment_status', 'housing_situation', 'dining_habits',
+        'monthly_subscription', 'monthly_income', 'monthly_expenses',
+        'total_debt', 'credit_score', 'bank_account_balance',
+        'financial_goal', 'financial_confidence_score', 'context'
+    )
+    
+    # Text columns stored with field-level AES-GCM encryption
+    ENCRYPTED_FIELDS = {
+        'location', 'employment_status', 'housing_situation',
+        'dining_habits', 'financial_goal', 'context'
+    }
+    
+    # Columns that may be returned when listing users (never the password)
+    LISTABLE_FIELDS = tuple(f for f in USER_FIELDS if f != 'password')
+    
+    def __init__(self, db_name='user.db', password='your_password_here', backend=None):
+        # Defaults to the encrypted file engine for db_name
+        self.backend = backend or EncryptedFileBackend(db_name=db_name, password=password)
+        self.conn = None
+    
+    def __enter__(self):
+        """Open a storage session"""
+        self.conn = self.backend.open()
+        return self.conn
+    
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        """Close the storage session"""
+        self.backend.close(self.conn)
     
     def create_table(self):
         """Public method to ensure table exists"""
@@ -200,20 +384,20 @@ class UserDatabase:
                 # Prepare data - integers stay as integers, text fields get encrypted
                 data = {
                     'age': user_data.get('age'),
-                    'location': self._encrypt_field(user_data.get('location')),
+                    'location': self.backend.encrypt_field(user_data.get('location')),
                     'totalAmountInAccount': user_data.get('totalAmountInAccount'),
-                    'employment_status': self._encrypt_field(user_data.get('employment_status')),
-                    'housing_situation': self._encrypt_field(user_data.get('housing_situation')),
-                    'dining_habits': self._encrypt_field(user_data.get('dining_habits')),
+                    'employment_status': self.backend.encrypt_field(user_data.get('employment_status')),
+                    'housing_situation': self.backend.encrypt_field(user_data.get('housing_situation')),
+                    'dining_habits': self.backend.encrypt_field(user_data.get('dining_habits')),
                     'monthly_subscription': user_data.get('monthly_subscription'),
                     'monthly_income': user_data.get('monthly_income'),
                     'monthly_expenses': user_data.get('monthly_expenses'),
                     'total_debt': user_data.get('total_debt'),
                     'credit_score': user_data.get('credit_score'),
                     'bank_account_balance': user_data.get('bank_account_balance'),
-                    'financial_goal': self._encrypt_field(user_data.get('financial_goal')),
+                    'financial_goal': self.backend.encrypt_field(user_data.get('financial_goal')),
                     'financial_confidence_score': user_data.get('financial_confidence_score'),
-                    'context': self._encrypt_field(user_data.get('context'))
+                    'context': self.backend.encrypt_field(user_data.get('context'))
 
                 }
                 
@@ -297,7 +481,7 @@ class UserDatabase:
                             update_values.append(updated_data[field])
                         else:
                             # Other text fields are encrypted
-                            update_values.append(self._encrypt_field(updated_data[field]))
+                            update_values.append(self.backend.encrypt_field(updated_data[field]))
                 
                 # Handle password hash separately
                 if 'password' in updated_data:
@@ -360,20 +544,20 @@ class UserDatabase:
 
                     'password': row[2],
                     'age': row[3],
-                    'location': self._decrypt_field(row[4]),
+                    'location': self.backend.decrypt_field(row[4]),
                     'totalAmountInAccount': row[5],
-                    'employment_status': self._decrypt_field(row[6]),
-                    'housing_situation': self._decrypt_field(row[7]),
-                    'dining_habits': self._decrypt_field(row[8]),
+                    'employment_status': self.backend.decrypt_field(row[6]),
+                    'housing_situation': self.backend.decrypt_field(row[7]),
+                    'dining_habits': self.backend.decrypt_field(row[8]),
                     'monthly_subscription': row[9],
                     'monthly_income': row[10],
                     'monthly_expenses': row[11],
                     'total_debt': row[12],
                     'credit_score': row[13],
                     'bank_account_balance': row[14],
-                    'financial_goal': self._decrypt_field(row[15]),
+                    'financial_goal': self.backend.decrypt_field(row[15]),
                     'financial_confidence_score': row[16],
-                    'context': self._decrypt_field(row[17])
+                    'context': self.backend.decrypt_field(row[17])
 
                 }
                 
@@ -383,6 +567,99 @@ class UserDatabase:
         except Exception as e:
             print(f"Error retrieving user: {e}")
             return None
+    
+    def iter_users(self, fields=None, after_id=0, limit=None, batch_size=500):
+        """
+        Stream users in id order using keyset pagination
+        
+        Rows are read from a private snapshot of the database taken before
+        this method returns (one decrypt for the whole iteration), so a
+        snapshot failure raises here rather than mid-stream. Rows are fetched in
+        batches of `batch_size`, so the number of users held at once stays
+        constant. Only the requested columns are selected, and only encrypted
+        ones among them are decrypted. Writes made while a stream is being
+        consumed are not included in it.
+        
+        Args:
+            fields: List of columns to include (defaults to all listable fields);
+                'id' is always included and may be listed or left out
+            after_id: Only return users with an id greater than this
+            limit: Maximum number of users to yield, or None for all
+            batch_size: Number of rows fetched per query
+            
+        Returns:
+            Generator of dictionaries with 'id' plus the requested fields
+            
+        Raises:
+            ValueError: If an unknown or non-listable field is requested
+            Exception: If the database snapshot cannot be opened (e.g. the
+                encrypted file fails to decrypt)
+        """
+        if fields is None:
+            columns = self.LISTABLE_FIELDS
+        else:
+            # id is always selected as the pagination key
+            fields = [f for f in fields if f != 'id']
+            unknown = [f for f in fields if f not in self.LISTABLE_FIELDS]
+            if unknown:
+                raise ValueError(f"Unknown field(s): {', '.join(unknown)}")
+            columns = tuple(dict.fromkeys(fields))
+        
+        conn = self.backend.open_snapshot()
+        return self._iter_user_rows(conn, columns, after_id, limit, batch_size)
+    
+    def _iter_user_rows(self, conn, columns, after_id, limit, batch_size):
+        """Generator backing iter_users; closes the snapshot connection it is given"""
+        select_list = ', '.join(('id',) + columns)
+        query = f"SELECT {select_list} FROM users WHERE id > ? ORDER BY id LIMIT ?"
+        remaining = limit
+        
+        try:
+            cursor = conn.cursor()
+            
+            while remaining is None or remaining > 0:
+                size = batch_size if remaining is None else min(batch_size, remaining)
+                cursor.execute(query, (after_id, size))
+                rows = cursor.fetchall()
+                
+                for row in rows:
+                    user = {'id': row[0]}
+                    for column, value in zip(columns, row[1:]):
+                        if column in self.ENCRYPTED_FIELDS:
+                            value = self.backend.decrypt_field(value)
+                        user[column] = value
+                    yield user
+                
+                if len(rows) < size:
+                    break
+                
+                after_id = rows[-1][0]
+                if remaining is not None:
+                    remaining -= len(rows)
+        finally:
+            conn.close()
+    
+    def list_users(self, after_id=0, limit=50, fields=None):
+        """
+        Retrieve one page of decrypted users
+        
+        Args:
+            after_id: Keyset cursor; pass the previous page's next_after_id
+            limit: Maximum number of users in the page
+            fields: List of columns to include (defaults to all listable fields)
+            
+        Returns:
+            Tuple of (users, next_after_id), where next_after_id is None on
+            the last page, or None if the listing failed
+        """
+        try:
+            users = list(self.iter_users(fields=fields, after_id=after_id, limit=limit))
+            next_after_id = users[-1]['id'] if users and len(users) == limit else None
+            return users, next_after_id
+            
+        except Exception as e:
+            print(f"Error listing users: {e}")
+            return None
 
 
 def main():
@@ -1,8 +1,9 @@
-from flask import Flask, jsonify, request, session
+from flask import Flask, Response, jsonify, request, session
 from flask_cors import CORS
 import os
 import json
-from ..db.dbManager import UserDatabase, encrypt_password # Import UserDatabase and encrypt_password
+import hmac
+from ..db.dbManager import UserDatabase, create_backend, encrypt_password # Import UserDatabase, the backend factory and encrypt_password
 
 app = Flask(__name__)
 app.secret_key = os.getenv('FLASK_SECRET_KEY', 'a_very_secret_key_for_session') # Needed for sessions
@@ -10,9 +11,13 @@ CORS(app, supports_credentials=True) # Allow credentials for session cookies
 
 # Initialize database
 DB_PASSWORD = os.getenv('DB_PASSWORD', 'my_super_secret_password')
-db = UserDatabase(db_name='user.db', password=DB_PASSWORD)
+DB_BACKEND = os.getenv('DB_BACKEND', 'file') # 'file' (encrypted user.db) or 'memory' (ephemeral, for tests)
+db = UserDatabase(backend=create_backend(DB_BACKEND, db_name='user.db', password=DB_PASSWORD))
 db.create_table() # Ensure the table exists
 
+MAX_PAGE_SIZE = 500 # Upper bound for a single JSON page of /api/users
+ADMIN_TOKEN = os.getenv('ADMIN_TOKEN') # Required in X-Admin-Token for /api/users; unset disables the listing
+
 @app.route('/')
 def hello_world():
     return "Hello, World!"
@@ -84,6 +89,56 @@ def get_user(name):
     else:
         return jsonify({"error": f"User '{name}' not found"}), 404
 
+@app.route('/api/users', methods=['GET'])
+def list_users():
+    # Keyset pagination: ?after_id=<last id seen>&limit=<n>&fields=a,b
+    # Add ?format=ndjson to stream every matching user as one JSON object per line
+    # Bulk listing exposes every user's data, so it needs a session and the admin token
+    if not session.get('logged_in'):
+        return jsonify({"error": "Login required"}), 401
+    
+    token = request.headers.get('X-Admin-Token', '')
+    if not ADMIN_TOKEN or not hmac.compare_digest(token, ADMIN_TOKEN):
+        return jsonify({"error": "Admin token required"}), 403
+    
+    try:
+        after_id = int(request.args.get('after_id', 0))
+        limit = int(request.args['limit']) if 'limit' in request.args else None
+    except ValueError:
+        return jsonify({"error": "after_id and limit must be integers"}), 400
+    
+    if after_id < 0 or (limit is not None and limit < 1):
+        return jsonify({"error": "after_id must be >= 0 and limit must be >= 1"}), 400
+    
+    fields = request.args.get('fields')
+    fields = [f for f in fields.split(',') if f] if fields else None
+    unknown = [f for f in fields or [] if f != 'id' and f not in UserDatabase.LISTABLE_FIELDS]
+    if unknown:
+        return jsonify({"error": f"Unknown field(s): {', '.join(unknown)}"}), 400
+    
+    if request.args.get('format') == 'ndjson':
+        # Open the snapshot before any headers are sent, so a failure is a 500
+        # rather than a truncated 200 stream
+        try:
+            users = db.iter_users(fields=fields, after_id=after_id, limit=limit)
+        except Exception as e:
+            print(f"Error listing users: {e}")
+            return jsonify({"error": "Failed to list users"}), 500
+        
+        def generate():
+            for user in users:
+                yield json.dumps(user) + '\n'
+        
+        return Response(generate(), mimetype='application/x-ndjson')
+    
+    limit = min(limit or 50, MAX_PAGE_SIZE)
+    page = db.list_users(after_id=after_id, limit=limit, fields=fields)
+    if page is None:
+        return jsonify({"error": "Failed to list users"}), 500
+    
+    users, next_after_id = page
+    return jsonify({"users": users, "next_after_id": next_after_id}), 200
+
 @app.route('/api/submit_form', methods=['POST'])
 def submit_form():
     form_data = request.get_json()
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Import db/ as a package, the same way flask-backend/app.py does
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
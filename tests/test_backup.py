@@ -0,0 +1,146 @@
+import json
+import os
+
+import pytest
+
+from db.backup import BackupStore
+from db.dbManager import MemoryBackend, UserDatabase
+
+
+def make_db(path, name):
+    db = UserDatabase(db_name=str(path / 'user.db'), password='test_password')
+    assert db.save_user({'name': name, 'password': 'hashed', 'location': f'{name} town'})
+    return db
+
+
+def test_snapshot_and_restore_round_trip(tmp_path):
+    db = make_db(tmp_path, 'alice')
+    store = BackupStore(db, backup_dir=str(tmp_path / 'backups'))
+
+    manifest = store.snapshot()
+    assert manifest is not None
+    assert store.verify(manifest['id'])
+
+    assert db.save_user({'name': 'bob', 'password': 'hashed'})
+    assert not store.restore(manifest['id'])  # existing database needs force
+    assert store.restore(manifest['id'], force=True)
+
+    assert db.get_user('alice')['location'] == 'alice town'
+    assert db.get_user('bob') is None
+
+
+def test_unchanged_chunks_are_not_stored_twice(tmp_path):
+    db = make_db(tmp_path, 'alice')
+    store = BackupStore(db, backup_dir=str(tmp_path / 'backups'))
+
+    first = store.snapshot()
+    second = store.snapshot()
+    assert first['chunks'] == second['chunks']
+    assert len(store.list_snapshots()) == 2
+
+
+def test_snapshot_does_not_touch_live_files(tmp_path):
+    db = make_db(tmp_path, 'alice')
+    store = BackupStore(db, backup_dir=str(tmp_path / 'backups'))
+    encrypted = tmp_path / 'user.db.enc'
+    before = encrypted.read_bytes()
+
+    with db as conn:
+        conn.execute("INSERT INTO users (name, password) VALUES ('inflight', 'x')")
+        conn.commit()
+        assert store.snapshot() is not None
+        assert encrypted.read_bytes() == before
+
+    assert db.get_user('inflight') is not None
+
+
+def test_failed_restore_leaves_live_database_intact(tmp_path):
+    backup_dir = str(tmp_path / 'backups')
+    os.makedirs(tmp_path / 'source')
+    source = make_db(tmp_path / 'source', 'alice')
+    manifest = BackupStore(source, backup_dir=backup_dir).snapshot()
+
+    # Corrupt one chunk of the snapshot
+    chunk_id = manifest['chunks'][0]
+    chunk_path = os.path.join(backup_dir, 'chunks', chunk_id[:2], chunk_id)
+    with open(chunk_path, 'rb') as f:
+        data = bytearray(f.read())
+    data[-1] ^= 1
+    with open(chunk_path, 'wb') as f:
+        f.write(data)
+
+    # A different live database, with its own salt
+    os.makedirs(tmp_path / 'live')
+    live = make_db(tmp_path / 'live', 'carol')
+    salt_before = (tmp_path / 'live' / 'user.db.salt').read_bytes()
+
+    assert not BackupStore(live, backup_dir=backup_dir).restore(manifest['id'], force=True)
+
+    assert (tmp_path / 'live' / 'user.db.salt').read_bytes() == salt_before
+    reopened = UserDatabase(db_name=str(tmp_path / 'live' / 'user.db'), password='test_password')
+    assert reopened.get_user('carol')['location'] == 'carol town'
+
+
+def test_restore_refuses_while_a_session_is_open(tmp_path):
+    db = make_db(tmp_path, 'alice')
+    store = BackupStore(db, backup_dir=str(tmp_path / 'backups'))
+    manifest = store.snapshot()
+
+    with db as conn:
+        conn.execute("INSERT INTO users (name, password) VALUES ('bob', 'x')")
+        conn.commit()
+        assert not store.restore(manifest['id'], force=True)
+
+    # The session's write survived, and a restore works once it has closed
+    assert db.get_user('bob') is not None
+    assert store.restore(manifest['id'], force=True)
+    assert db.get_user('bob') is None
+
+
+def test_prune_removes_old_snapshots_and_unused_chunks(tmp_path):
+    db = make_db(tmp_path, 'alice')
+    store = BackupStore(db, backup_dir=str(tmp_path / 'backups'))
+
+    old = store.snapshot()
+    assert db.update_user('alice', {'location': 'elsewhere'})
+    new = store.snapshot()
+
+    assert store.prune(1) == (1, len(set(old['chunks']) - set(new['chunks'])))
+    assert [m['id'] for m in store.list_snapshots()] == [new['id']]
+    assert store.verify(new['id'])
+
+
+def test_snapshot_and_prune_do_not_overlap(tmp_path):
+    db = make_db(tmp_path, 'alice')
+    store = BackupStore(db, backup_dir=str(tmp_path / 'backups'))
+    manifest = store.snapshot()
+
+    # Another snapshot or prune holds the lock
+    lock = tmp_path / 'backups' / 'lock'
+    lock.write_text('12345')
+    assert store.snapshot() is None
+    assert store.prune(1) is None
+    assert lock.exists()
+
+    lock.unlink()
+    assert store.prune(1) == (0, 0)
+    assert store.verify(manifest['id'])
+    assert not lock.exists()
+
+
+def test_kdf_parameters_are_recorded_and_reused(tmp_path, monkeypatch):
+    db = make_db(tmp_path, 'alice')
+    backup_dir = tmp_path / 'backups'
+    manifest = BackupStore(db, backup_dir=str(backup_dir)).snapshot()
+
+    with open(backup_dir / 'kdf.json') as f:
+        assert json.load(f) == {'iterations': BackupStore.KDF_ITERATIONS, 'hash': 'SHA256'}
+
+    # Changing the defaults later must not break existing backups
+    monkeypatch.setattr(BackupStore, 'KDF_ITERATIONS', 1000)
+    assert BackupStore(db, backup_dir=str(backup_dir)).verify(manifest['id'])
+
+
+def test_backups_require_file_backend():
+    with pytest.raises(ValueError):
+        BackupStore(UserDatabase(backend=MemoryBackend()))
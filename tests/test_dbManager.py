@@ -0,0 +1,149 @@
+import pytest
+
+from db.dbManager import EncryptedFileBackend, MemoryBackend, UserDatabase, create_backend
+
+
+@pytest.fixture
+def db():
+    db = UserDatabase(backend=MemoryBackend(password='test_password'))
+    db.create_table()
+    return db
+
+
+def add_users(db, count):
+    for i in range(count):
+        assert db.save_user({
+            'name': f'user{i}',
+            'password': 'hashed',
+            'age': 20 + i,
+            'location': f'City {i}',
+            'context': f'Context {i}'
+        })
+
+
+def test_iter_users_pages_in_id_order(db):
+    add_users(db, 7)
+
+    users = list(db.iter_users(fields=['name'], batch_size=3))
+    assert [u['name'] for u in users] == [f'user{i}' for i in range(7)]
+    assert [u['id'] for u in users] == sorted(u['id'] for u in users)
+
+    users = list(db.iter_users(fields=['name'], after_id=2, limit=3, batch_size=2))
+    assert [u['name'] for u in users] == ['user2', 'user3', 'user4']
+
+
+def test_iter_users_only_returns_requested_fields(db):
+    add_users(db, 2)
+
+    users = list(db.iter_users(fields=['location', 'age']))
+    assert users[0] == {'id': 1, 'location': 'City 0', 'age': 20}
+
+    users = list(db.iter_users(fields=['id', 'name']))
+    assert users[0] == {'id': 1, 'name': 'user0'}
+
+    users = list(db.iter_users())
+    assert set(users[0]) == {'id'} | set(UserDatabase.LISTABLE_FIELDS)
+    assert 'password' not in users[0]
+
+
+def test_iter_users_rejects_password_and_unknown_fields(db):
+    with pytest.raises(ValueError):
+        db.iter_users(fields=['password'])
+    with pytest.raises(ValueError):
+        db.iter_users(fields=['name', 'bogus'])
+
+
+def test_iter_users_does_not_see_writes_made_during_the_stream(db):
+    add_users(db, 3)
+
+    stream = db.iter_users(fields=['name'])
+    assert next(stream)['name'] == 'user0'
+    assert db.save_user({'name': 'late', 'password': 'hashed'})
+    assert [u['name'] for u in stream] == ['user1', 'user2']
+
+
+def test_list_users_returns_keyset_cursor(db):
+    add_users(db, 5)
+
+    users, next_after_id = db.list_users(limit=2, fields=['name'])
+    assert [u['name'] for u in users] == ['user0', 'user1']
+
+    users, next_after_id = db.list_users(after_id=next_after_id, limit=2, fields=['name'])
+    assert [u['name'] for u in users] == ['user2', 'user3']
+
+    users, next_after_id = db.list_users(after_id=next_after_id, limit=2, fields=['name'])
+    assert [u['name'] for u in users] == ['user4']
+    assert next_after_id is None
+
+    assert db.list_users(fields=['password']) is None
+
+
+def test_save_and_get_user(db):
+    add_users(db, 1)
+
+    user = db.get_user('user0')
+    assert user['name'] == 'user0'
+    assert user['age'] == 20
+    assert user['location'] == 'City 0'
+    assert user['context'] == 'Context 0'
+    assert db.get_user('missing') is None
+
+
+def test_text_fields_are_encrypted_at_rest(db):
+    add_users(db, 1)
+
+    with db as conn:
+        location, age = conn.execute('SELECT location, age FROM users').fetchone()
+    assert location != 'City 0'
+    assert db.backend.decrypt_field(location) == 'City 0'
+    assert age == 20
+
+
+def test_update_user(db):
+    add_users(db, 1)
+
+    assert db.update_user('user0', {'age': 40, 'location': 'Austin'})
+    user = db.get_user('user0')
+    assert user['age'] == 40
+    assert user['location'] == 'Austin'
+    assert not db.update_user('missing', {'age': 1})
+
+
+def test_memory_session_discards_uncommitted_writes(db):
+    with pytest.raises(RuntimeError):
+        with db as conn:
+            conn.execute("INSERT INTO users (name, password) VALUES ('ghost', 'x')")
+            raise RuntimeError
+
+    add_users(db, 1)
+    assert db.get_user('ghost') is None
+
+
+def test_create_backend():
+    assert isinstance(create_backend('memory', password='pw'), MemoryBackend)
+
+    backend = create_backend('file', db_name='other.db', password='pw')
+    assert isinstance(backend, EncryptedFileBackend)
+    assert backend.encrypted_name == 'other.db.enc'
+
+    with pytest.raises(ValueError):
+        create_backend('bogus')
+
+
+def test_file_backend_round_trip(tmp_path):
+    db = UserDatabase(db_name=str(tmp_path / 'user.db'), password='test_password')
+    add_users(db, 3)
+
+    assert db.get_user('user1')['location'] == 'City 1'
+    assert [u['name'] for u in db.iter_users(fields=['name'])] == ['user0', 'user1', 'user2']
+    assert sorted(p.name for p in tmp_path.iterdir()) == ['user.db.enc', 'user.db.salt']
+
+
+def test_iter_users_fails_before_streaming_when_snapshot_fails(tmp_path):
+    db_name = str(tmp_path / 'user.db')
+    add_users(UserDatabase(db_name=db_name, password='test_password'), 1)
+
+    wrong = UserDatabase(db_name=db_name, password='wrong_password')
+    with pytest.raises(ValueError):
+        wrong.iter_users(fields=['name'])
+    assert wrong.list_users() is None